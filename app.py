@@ -1,11 +1,17 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import numpy_groupies as npg
 import plotly.express as px
 import plotly.graph_objects as go
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+import io
 import json
-import re
+from concurrent.futures import ThreadPoolExecutor
+
+# 컬럼 단위 할당 시 프레임 전체 대신 해당 컬럼만 복사되도록 Copy-on-Write 사용
+pd.options.mode.copy_on_write = True
 
 # 페이지 기본 설정
 st.set_page_config(
@@ -13,157 +19,246 @@ st.set_page_config(
     layout="wide"
 )
 
+# 필수 컬럼 목록
+REQUIRED_COLUMNS = ('모델명', '처리방식', '수량')
+
+# 유효한 처리방식 목록
+VALID_METHODS = ('단순변심', '수거하면할', '물량교환', '물량환불', '수거하면 할',
+                 '오배송환불', '오배송교환', '본사교환(오주문)', '택배사사고환불')
+VALID_METHODS_SET = frozenset(VALID_METHODS)
+
+# 제외할 모델명 패턴: 빈 값 | 숫자만 | 날짜 형식 | 특수문자로 시작
+# (Arrow 문자열 커널에 그대로 전달하므로 컴파일하지 않은 문자열로 유지)
+_INVALID_PATTERN = r'^\s*$|^\d+$|\d{2,4}[-/]\d{1,2}[-/]\d{1,2}|^[^A-Za-z0-9가-힣]'
+
 def clean_dataframe(df):
     """데이터프레임 정리"""
     if df is None or df.empty:
         return df
         
     # 필수 컬럼 확인
-    required_columns = ['모델명', '처리방식', '수량']
-    if not all(col in df.columns for col in required_columns):
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
         return None
         
-    # 컬럼 선택 및 데이터 정리
-    df = df[required_columns].copy()
+    # 처리방식이 유효한 것만 먼저 선택해 이후 정제 대상 축소
+    # (필수 컬럼 선택은 로드 단계에서 처리)
+    methods = df['처리방식'].astype('string[pyarrow]').str.strip()
+    valid = methods.isin(VALID_METHODS_SET)
+    df = df[valid]
+    df['처리방식'] = methods[valid]
     
     # 데이터 정제
-    df['모델명'] = df['모델명'].astype(str).str.strip()
-    df['처리방식'] = df['처리방식'].astype(str).str.strip()
-    df['수량'] = pd.to_numeric(df['수량'], errors='coerce').fillna(0)
-    
-    # 빈 값이나 숫자만 있는 행, 날짜 형식의 행 제거
-    df = df[df['모델명'].str.len() > 0]  # 빈 문자열 제거
-    df = df[~df['모델명'].str.match(r'^\d+$')]  # 숫자만 있는 행 제거
-    df = df[~df['모델명'].str.contains(r'\d{2,4}[-/]\d{1,2}[-/]\d{1,2}')]  # 날짜 형식 제거
+    models = df['모델명'].astype('string[pyarrow]').str.strip()
+    df['모델명'] = models
+    df['수량'] = pd.to_numeric(df['수량'], errors='coerce').fillna(0).astype('int32')
     
-    # 특수문자로 시작하는 행 제거
-    df = df[~df['모델명'].str.match(r'^[^A-Za-z0-9가-힣]')]
+    # 빈 값, 숫자만 있는 행, 날짜 형식, 특수문자로 시작하는 행을 한 번에 제거
+    df = df[~models.str.contains(_INVALID_PATTERN, na=True)]
     
-    # 처리방식이 유효한 것만 선택
-    valid_methods = ['단순변심', '수거하면할', '물량교환', '물량환불', '수거하면 할', 
-                    '오배송환불', '오배송교환', '본사교환(오주문)', '택배사사고환불']
-    df = df[df['처리방식'].isin(valid_methods)]
+    # 범주형으로 변환해 정수 코드 기반으로 처리
+    models = df['모델명'].astype('category').cat
+    methods = pd.Categorical(df['처리방식'], categories=VALID_METHODS)
     
-    # 그룹화하여 합계 계산
-    df = df.groupby(['모델명', '처리방식'], as_index=False)['수량'].sum()
+    # (모델명, 처리방식) 코드별 합계 계산
+    sums = npg.aggregate(
+        (models.codes.to_numpy(), methods.codes),
+        df['수량'].to_numpy(),
+        func='sum',
+        size=(len(models.categories), len(VALID_METHODS)),
+        dtype=np.int32
+    )
     
-    # 수량이 0인 행 제거
-    df = df[df['수량'] > 0]
+    # 수량이 0인 조합 제거 후 데이터프레임으로 변환
+    rows, cols = np.nonzero(sums > 0)
+    df = pd.DataFrame({
+        '모델명': pd.Categorical.from_codes(rows, categories=models.categories),
+        '처리방식': pd.Categorical.from_codes(cols, categories=VALID_METHODS),
+        '수량': sums[rows, cols]
+    })
     
     return df
 
-def load_google_sheet(spreadsheet_url):
+def _sum_by_category(keys, values):
+    """범주형 키별 합계 (합계가 0인 범주 제외)"""
+    sums = npg.aggregate(
+        keys.cat.codes.to_numpy(),
+        values.to_numpy(),
+        func='sum',
+        size=len(keys.cat.categories),
+        dtype=values.dtype
+    )
+    totals = pd.Series(sums, index=keys.cat.categories.rename(keys.name), name=values.name)
+    return totals[totals > 0]
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _fetch_sheets(spreadsheet_url):
+    """스프레드시트의 모든 워크시트를 읽어 정리된 데이터프레임으로 반환 (URL 기준 캐시)"""
+    # Google Sheets API 인증
+    scope = ['https://spreadsheets.google.com/feeds',
+            'https://www.googleapis.com/auth/drive']
+    
+    # Streamlit secrets에서 credentials 불러오기
+    credentials_info = st.secrets["credentials"]
+    credentials_dict = json.loads(credentials_info)
+    credentials = ServiceAccountCredentials.from_json_keyfile_dict(
+        credentials_dict, scope)
+    
+    gc = gspread.authorize(credentials)
+    
+    # URL에서 스프레드시트 열기
+    sheet = gc.open_by_url(spreadsheet_url)
+    
+    # 값을 읽을 수 있는 일반(GRID) 시트만 선택 (차트 전용 시트 등 제외)
+    worksheets = [worksheet for worksheet in sheet.worksheets()
+                  if worksheet._properties.get('sheetType', 'GRID') == 'GRID']
+    
+    # 모든 워크시트의 값을 한 번의 요청으로 가져오기
     try:
-        # Google Sheets API 인증
-        scope = ['https://spreadsheets.google.com/feeds',
-                'https://www.googleapis.com/auth/drive']
-        
-        # Streamlit secrets에서 credentials 불러오기
-        credentials_info = st.secrets["credentials"]
-        credentials_dict = json.loads(credentials_info)
-        credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-            credentials_dict, scope)
-        
-        gc = gspread.authorize(credentials)
-        
-        # URL에서 스프레드시트 열기
-        sheet = gc.open_by_url(spreadsheet_url)
-        
-        # 모든 워크시트 처리
-        all_sheets = {}
-        for worksheet in sheet.worksheets():
-            try:
-                # 데이터를 데이터프레임으로 변환
+        response = sheet.values_batch_get(
+            ranges=[gspread.utils.absolute_range_name(worksheet.title) for worksheet in worksheets])
+        batch_values = [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+    except gspread.exceptions.APIError:
+        # 일괄 요청이 실패하면 시트별로 가져와 문제 있는 시트만 건너뜀
+        batch_values = None
+    
+    # 모든 워크시트 처리
+    all_sheets = {}
+    for i, worksheet in enumerate(worksheets):
+        title = worksheet.title
+        try:
+            # 데이터를 데이터프레임으로 변환 (API는 행 끝의 빈 셀을 생략하므로 채워 넣음)
+            if batch_values is not None:
+                data = gspread.utils.fill_gaps(batch_values[i])
+            else:
                 data = worksheet.get_all_values()
-                if not data:  # 빈 시트 건너뛰기
-                    continue
-                    
-                headers = data[0]
-                values = data[1:]
-                
-                # 필수 컬럼이 없는 시트 건너뛰기
-                if not all(col in headers for col in ['모델명', '처리방식', '수량']):
-                    continue
-                    
-                df = pd.DataFrame(values, columns=headers)
+            if not data:  # 빈 시트 건너뛰기
+                continue
                 
-                # 데이터 정리
-                cleaned_df = clean_dataframe(df)
-                if cleaned_df is not None and not cleaned_df.empty:
-                    all_sheets[worksheet.title] = cleaned_df
-                    
-            except Exception as e:
-                st.error(f"{worksheet.title} 시트 처리 중 오류 발생: {str(e)}")
+            headers = data[0]
+            values = data[1:]
+            
+            # 필수 컬럼이 없는 시트 건너뛰기
+            if not all(col in headers for col in REQUIRED_COLUMNS):
                 continue
-        
-        return all_sheets
+                
+            # 모델명이 비어 있는 행(빈 행 포함)은 데이터프레임 생성 전에 제외
+            model_idx = headers.index('모델명')
+            values = [row for row in values if row[model_idx].strip()]
+            
+            # 필수 컬럼만 1차원 배열로 꺼내 데이터프레임 생성
+            arr = np.array(values, dtype=object).reshape(len(values), len(headers))
+            df = pd.DataFrame({col: arr[:, headers.index(col)] for col in REQUIRED_COLUMNS})
+            
+            # 데이터 정리
+            cleaned_df = clean_dataframe(df)
+            if cleaned_df is not None and not cleaned_df.empty:
+                all_sheets[title] = cleaned_df
+                
+        except Exception as e:
+            st.error(f"{title} 시트 처리 중 오류 발생: {str(e)}")
+            continue
+    
+    return all_sheets
+
+def load_google_sheet(spreadsheet_url):
+    try:
+        # 예외는 캐시되지 않으므로 실패한 경우 다음 실행 때 다시 시도됨
+        return _fetch_sheets(spreadsheet_url)
         
     except Exception as e:
         st.error(f"스프레드시트 로드 중 오류가 발생했습니다: {str(e)}")
         return None
 
-def create_charts(data, title):
-    if data is None or data.empty:
-        st.error(f"{title}: 처리할 수 있는 데이터가 없습니다.")
-        return
-        
-    st.subheader(f"📊 {title}")
+@st.cache_data(show_spinner=False)
+def _load_excel(file_bytes):
+    """엑셀 파일의 모든 시트를 읽어 정리된 데이터프레임으로 반환 (파일 내용 기준 캐시)"""
+    # 모든 시트의 필수 컬럼만 한 번에 읽기 (정제 단계에서 형변환하므로 빈 셀도 그대로 문자열로 읽음)
+    sheets = pd.read_excel(
+        io.BytesIO(file_bytes),
+        sheet_name=None,
+        engine='calamine',
+        usecols=lambda col: col in REQUIRED_COLUMNS,
+        dtype=str,
+        na_filter=False
+    )
     
-    col1, col2 = st.columns(2)
+    if not sheets:
+        return {}
     
-    with col1:
-        st.subheader("처리방식별 비율")
-        process_summary = data.groupby('처리방식')['수량'].sum().reset_index()
-        total = process_summary['수량'].sum()
-        process_summary['비율'] = (process_summary['수량'] / total * 100).round(1)
-        process_summary = process_summary.sort_values('수량', ascending=False)
-        
-        fig_pie = px.pie(
-            process_summary,
-            values='수량',
-            names='처리방식',
-            hole=0.3,
-            custom_data=['비율']
-        )
-        fig_pie.update_traces(
-            hovertemplate="처리방식: %{label}<br>건수: %{value}<br>비율: %{customdata[0]}%"
-        )
-        st.plotly_chart(fig_pie, use_container_width=True)
+    # 각 시트의 데이터를 병렬로 정리 (시트 순서는 유지)
+    with ThreadPoolExecutor(max_workers=min(8, len(sheets))) as executor:
+        cleaned = executor.map(clean_dataframe, sheets.values())
     
-    with col2:
-        st.subheader("상위 10개 모델의 현황")
-        top_models = data.groupby('모델명')['수량'].sum().sort_values(ascending=False).head(10)
-        fig_bar = px.bar(
-            top_models,
-            x=top_models.index,
-            y='수량',
-            labels={'x': '모델명', 'y': '건수'}
-        )
-        fig_bar.update_traces(
-            hovertemplate="모델명: %{x}<br>건수: %{y}"
-        )
-        st.plotly_chart(fig_bar, use_container_width=True)
+    processed_sheets = {}
+    for sheet_name, cleaned_df in zip(sheets.keys(), cleaned):
+        if cleaned_df is not None and not cleaned_df.empty:
+            processed_sheets[sheet_name] = cleaned_df
     
-    st.subheader("처리방식별 상세 분석")
+    return processed_sheets
+
+def _hash_dataframe(df):
+    """데이터프레임 내용 전체 기준 해시 (인덱스 포함)"""
+    return pd.util.hash_pandas_object(df, index=True).values.tobytes()
+
+@st.cache_resource(max_entries=64, hash_funcs={pd.DataFrame: _hash_dataframe})
+def _build_figures(data):
+    """차트와 원본 데이터 테이블 생성 (정리된 데이터 기준 캐시)"""
+    # 모델별/처리방식별 총 건수는 한 번만 계산해 재사용
+    model_totals = _sum_by_category(data['모델명'], data['수량']).sort_values(ascending=False)
+    method_totals = _sum_by_category(data['처리방식'], data['수량']).sort_values(ascending=False)
     
-    # 모델별 총 건수 계산
-    model_totals = data.groupby('모델명')['수량'].sum()
-    top_models = model_totals.sort_values(ascending=False).head(20).index  # 상위 20개 모델만 선택
+    # 처리방식별 비율
+    process_summary = method_totals.reset_index()
+    total = process_summary['수량'].sum()
+    process_summary['비율'] = (process_summary['수량'] / total * 100).round(1)
     
-    # 상위 모델에 대한 피벗 테이블 생성
-    filtered_data = data[data['모델명'].isin(top_models)]
-    process_model = pd.pivot_table(
-        filtered_data,
+    # 툴팁 문자열을 미리 만들어 전달
+    pie_text = [
+        f"처리방식: {method}<br>건수: {count}<br>비율: {ratio}%"
+        for method, count, ratio in process_summary[['처리방식', '수량', '비율']].itertuples(index=False)
+    ]
+    
+    fig_pie = px.pie(
+        process_summary,
         values='수량',
-        index='모델명',
-        columns='처리방식',
-        fill_value=0
+        names='처리방식',
+        hole=0.3
+    )
+    fig_pie.update_traces(
+        hovertext=pie_text,
+        hovertemplate="%{hovertext}<extra></extra>"
+    )
+    
+    # 상위 10개 모델의 현황
+    top_models = model_totals.head(10)
+    fig_bar = px.bar(
+        top_models,
+        x=top_models.index,
+        y='수량',
+        labels={'x': '모델명', 'y': '건수'}
+    )
+    fig_bar.update_traces(
+        hovertemplate="모델명: %{x}<br>건수: %{y}"
     )
     
-    # 합계로 정렬
-    process_model['합계'] = process_model.sum(axis=1)
-    process_model = process_model.sort_values('합계', ascending=False)
-    process_model = process_model.drop('합계', axis=1)
+    # 처리방식별 상세 분석
+    top_models = model_totals.head(20).index  # 상위 20개 모델만 선택
+    
+    # (모델명 x 처리방식) 행렬에 수량을 직접 누적
+    models = data['모델명'].cat
+    methods = data['처리방식'].cat
+    matrix = np.zeros((len(models.categories), len(methods.categories)), dtype=np.int32)
+    np.add.at(matrix, (models.codes.to_numpy(), methods.codes.to_numpy()), data['수량'].to_numpy())
+    
+    # 상위 모델 행과 값이 있는 처리방식 열만 선택
+    matrix = matrix[models.categories.get_indexer(top_models)]
+    used_methods = matrix.any(axis=0)
+    matrix = matrix[:, used_methods]
+    method_labels = list(methods.categories[used_methods])
+    
+    # 합계로 정렬 (합계 컬럼을 추가하지 않고 행 순서만 계산)
+    order = np.argsort(-matrix.sum(axis=1), kind='stable')
+    process_model = pd.DataFrame(matrix[order], index=top_models[order], columns=method_labels)
     
     fig_heatmap = px.imshow(
         process_model,
@@ -171,14 +266,48 @@ def create_charts(data, title):
         labels=dict(x='처리방식', y='모델명', color='건수'),
         color_continuous_scale='Blues'
     )
+    
+    # 툴팁 문자열을 셀별로 미리 만들어 전달
+    heatmap_text = [
+        [f"모델명: {model}<br>처리방식: {method}<br>건수: {count}" for method, count in zip(method_labels, row)]
+        for model, row in zip(process_model.index, process_model.to_numpy())
+    ]
     fig_heatmap.update_traces(
-        hovertemplate="모델명: %{y}<br>처리방식: %{x}<br>건수: %{z}"
+        text=heatmap_text,
+        hovertemplate="%{text}<extra></extra>"
     )
+    
+    # 원본 데이터 테이블
+    table = data.sort_values(['모델명', '처리방식'])
+    
+    return fig_pie, fig_bar, fig_heatmap, table
+
+def create_charts(data, title):
+    if data is None or data.empty:
+        st.error(f"{title}: 처리할 수 있는 데이터가 없습니다.")
+        return
+        
+    st.subheader(f"📊 {title}")
+    
+    # 데이터가 바뀌지 않았으면 캐시된 차트 재사용
+    fig_pie, fig_bar, fig_heatmap, table = _build_figures(data)
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("처리방식별 비율")
+        st.plotly_chart(fig_pie, use_container_width=True)
+    
+    with col2:
+        st.subheader("상위 10개 모델의 현황")
+        st.plotly_chart(fig_bar, use_container_width=True)
+    
+    st.subheader("처리방식별 상세 분석")
     st.plotly_chart(fig_heatmap, use_container_width=True)
     
     with st.expander("원본 데이터 보기"):
         st.dataframe(
-            data.sort_values(['모델명', '처리방식']),
+            table,
             column_config={
                 "모델명": st.column_config.TextColumn("모델명", width="medium"),
                 "처리방식": st.column_config.TextColumn("처리방식", width="medium"),
@@ -202,17 +331,8 @@ def main():
         
         if uploaded_file is not None:
             try:
-                # 엑셀 파일의 모든 시트 읽기
-                excel_file = pd.ExcelFile(uploaded_file)
-                sheet_names = excel_file.sheet_names
-                
-                # 각 시트의 데이터 처리
-                processed_sheets = {}
-                for sheet_name in sheet_names:
-                    df = pd.read_excel(uploaded_file, sheet_name=sheet_name)
-                    cleaned_df = clean_dataframe(df)
-                    if cleaned_df is not None and not cleaned_df.empty:
-                        processed_sheets[sheet_name] = cleaned_df
+                # 엑셀 파일의 모든 시트 읽기 (같은 파일이면 캐시된 결과 사용)
+                processed_sheets = _load_excel(uploaded_file.getvalue())
                 
                 if processed_sheets:
                     # 탭 생성